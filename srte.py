@@ -1,7 +1,17 @@
+import io
 import os
+import html
 import re
 import time
-import chardet
+import asyncio
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from textwrap import shorten
+from chardet import UniversalDetector
+import numpy as np
+import pandas as pd
 import streamlit as st
 from google import genai
 from google.genai import types
@@ -12,6 +22,45 @@ MODELS = [
     "gemini-3.1-flash-lite",
     "gemini-3-flash-preview"
 ]
+# Blocks shorter than this go to the lite models only
+SHORT_TEXT_CHARS = 40
+# Model chain per tier; lite/full output without any Arabic is retried once on the fallback
+MODEL_TIERS = {
+    "lite": ["gemini-2.5-flash-lite", "gemini-3.1-flash-lite"],
+    # Longer blocks stay on the strongest model and only move down the chain on a quota hit or error
+    "full": ["gemini-3-flash-preview", "gemini-3.1-flash-lite", "gemini-2.5-flash-lite"],
+    "fallback": ["gemini-3-flash-preview"],
+}
+# Regex to detect any Arabic character
+ARABIC_RE = re.compile(r'[\u0600-\u06FF]')
+# Marker placed before every block in prompts and expected back in responses
+BLOCK_RE = re.compile(r'<<<BLOCK (\d+)>>>')
+# Distinct English texts kept in the shared translation cache (least recently used are evicted)
+TRANSLATION_CACHE_SIZE = 50_000
+# Bytes fed to the encoding detector per step
+DETECT_CHUNK = 4096
+# Columns of the subtitle table kept in st.session_state.subs_df;
+# start/end are milliseconds (uint32), formatted back to SRT time only for display and export;
+# settings is whatever followed the end time on the timing line (cue position etc.), kept verbatim;
+# timing holds the raw timing line of a block whose times could not be parsed (start/end are then 0)
+SUB_COLUMNS = ["index", "start", "end", "settings", "timing", "english", "arabic"]
+# HH:MM:SS,mmm (a '.' separator is accepted too)
+TIMESTAMP_RE = re.compile(r'(\d+):(\d{2}):(\d{2})[,.](\d{3})')
+# Largest time the uint32 start/end columns can hold (about 1193 hours)
+MAX_TIMESTAMP_MS = np.iinfo(np.uint32).max
+# SRT parser states
+EXPECT_INDEX, EXPECT_TS, EXPECT_TEXT, SKIP_BLOCK = range(4)
+# Blocks shown per page in the review list
+PAGE_SIZE = 50
+# Blocks are packed into one prompt until its estimated size reaches the budget
+BATCH_TOKEN_BUDGET = 6000
+MAX_BATCH_BLOCKS = 100
+MAX_CONCURRENCY = 8
+# Per key/model quota (free tier): requests per minute, input tokens per minute
+MODEL_RPM = 10
+MODEL_TPM = 250_000
+# Matches "retryDelay': '38s'" / "Please retry in 38.2s" in 429 error bodies
+RETRY_DELAY_RE = re.compile(r"retry(?:delay['\"]?\s*:\s*['\"]?|\s+in\s+)(\d+(?:\.\d+)?)s", re.IGNORECASE)
 
 st.set_page_config(layout="wide")
 st.title("SRT Editor & Translator: English → Arabic (AI)")
@@ -21,68 +70,416 @@ st.markdown("""
 <style>
 .subtitle-block { padding: 4px; margin-bottom: 4px; border: 1px solid #ddd; border-radius: 4px; background: #f9f9f9; }
 .block-heading { font-size: 1rem; font-weight: 600; margin-bottom: 3px; }
+.block-text { display: flex; gap: 12px; }
+.block-text > div { flex: 1; white-space: pre-wrap; }
 textarea { scrollbar-width: auto; scrollbar-color: #888 #f1f1f1; }
 </style>
 """, unsafe_allow_html=True)
 
 # --- Helpers ---
-def autodetect_decode(uploader):
-    raw = uploader.getvalue()
-    enc = chardet.detect(raw)["encoding"] or "utf-8"
+def detect_encoding(raw: bytes) -> str:
+    # Feed the detector a chunk at a time and stop as soon as it is confident
+    detector = UniversalDetector()
+    for i in range(0, len(raw), DETECT_CHUNK):
+        detector.feed(raw[i : i + DETECT_CHUNK])
+        if detector.done:
+            break
+    detector.close()
+    enc = detector.result["encoding"] or "utf-8"
+    # An ASCII-only prefix says nothing about the rest of the file; UTF-8 is the safe superset
+    return "utf-8" if enc == "ascii" else enc
+
+def autodetect_decode(raw: bytes):
+    enc = detect_encoding(raw)
     try:
         return raw.decode(enc)
     except:
         return raw.decode("utf-8", errors="ignore")
 
+def has_arabic(text):
+    # Plain ASCII can't contain Arabic; skip the regex for it
+    return not text.isascii() and ARABIC_RE.search(text) is not None
+
+def parse_timestamp(ts):
+    """SRT timestamp → milliseconds, or None if ts does not start with one or it is past MAX_TIMESTAMP_MS."""
+    m = TIMESTAMP_RE.match(ts.strip())
+    if not m:
+        return None
+    h, mins, secs, ms = map(int, m.groups())
+    total = h * 3_600_000 + mins * 60_000 + secs * 1000 + ms
+    return total if total <= MAX_TIMESTAMP_MS else None
+
+def format_timestamp(ms):
+    h, ms = divmod(int(ms), 3_600_000)
+    mins, ms = divmod(ms, 60_000)
+    secs, ms = divmod(ms, 1000)
+    return f"{h:02}:{mins:02}:{secs:02},{ms:03}"
+
+def iter_blocks(lines, skipped):
+    """Yield (index, start_ms, end_ms, settings, timing, english, arabic) per SRT block, consuming the input a line at a time.
+
+    A non-numeric index is replaced by the previous index + 1. A block whose timing line
+    has a '-->' but unreadable times is kept with that line in timing; the index of every
+    block dropped for a missing timing line is appended to skipped.
+    """
+    idx, start, end, settings, timing = 0, None, None, "", ""
+    arabic_lines, english_lines = [], []
+    state = EXPECT_INDEX
+    # Trailing sentinel flushes the last block
+    for line in itertools.chain(lines, [""]):
+        line = line.strip()
+        if not line:
+            if state == EXPECT_TEXT and (arabic_lines or english_lines):
+                yield idx, start, end, settings, timing, "\n".join(english_lines), "\n".join(arabic_lines)
+            elif state == EXPECT_TS:
+                skipped.append(idx)
+            state = EXPECT_INDEX
+        elif state == EXPECT_INDEX:
+            idx = int(line) if line.isdigit() else idx + 1
+            state = EXPECT_TS
+        elif state == EXPECT_TS:
+            start, arrow, end_ts = line.partition("-->")
+            if not arrow:
+                skipped.append(idx)
+                state = SKIP_BLOCK
+                continue
+            end_ts = end_ts.strip()
+            start, end = parse_timestamp(start), parse_timestamp(end_ts)
+            if start is None or end is None:
+                # Export the line as it came in rather than lose the block
+                start, end, settings, timing = 0, 0, "", line
+            else:
+                settings, timing = end_ts[TIMESTAMP_RE.match(end_ts).end():], ""
+            arabic_lines, english_lines = [], []
+            state = EXPECT_TEXT
+        elif state == EXPECT_TEXT:
+            (arabic_lines if has_arabic(line) else english_lines).append(line)
+
 def parse_srt(text: str):
-    text = text.replace('\r\n', '\n')
-    blocks = re.split(r'\n\s*\n', text.strip())
-    subs = []
-    for blk in blocks:
-        lines = blk.splitlines()
-        if len(lines) < 3 or "-->" not in lines[1]:
-            continue
-        idx = lines[0].strip()
-        start, end = [t.strip() for t in lines[1].split("-->")]
-        body_lines = [l.strip() for l in lines[2:] if l.strip()]
-        arabic_lines = [l for l in body_lines if any('\u0600' <= ch <= '\u06FF' for ch in l)]
-        english_lines = [l for l in body_lines if not any('\u0600' <= ch <= '\u06FF' for ch in l)]
-        subs.append({
-            "index": idx, "start": start, "end": end,
-            "english_lines": english_lines, "arabic": "\n".join(arabic_lines)
-        })
-    return subs
-
-def build_srt(subs):
+    """SRT text → (subtitle DataFrame, indices of the blocks dropped for having no timing line)."""
+    # StringIO below splits on '\n' only, so CR line endings are normalised first.
+    # LF-only uploads skip the copy entirely, CRLF uploads pay for a single replace.
+    if '\r' in text:
+        text = text.replace('\r\n', '\n')
+        if '\r' in text:
+            text = text.replace('\r', '\n')
+    skipped = []
+    # Build the columns directly instead of a dict per block
+    columns = tuple(zip(*iter_blocks(io.StringIO(text), skipped))) or ((),) * len(SUB_COLUMNS)
+    indices, starts, ends, settings, timing, english, arabic = columns
+    return pd.DataFrame({
+        "index": np.array(indices, dtype=np.int32),
+        "start": np.array(starts, dtype=np.uint32),
+        "end": np.array(ends, dtype=np.uint32),
+        "settings": list(settings),
+        "timing": list(timing),
+        "english": list(english),
+        "arabic": list(arabic),
+    }), skipped
+
+def load_subs(raw: bytes) -> tuple[pd.DataFrame, list[int]]:
+    # Not cached: the file_id gate below already parses each upload exactly once per session
+    return parse_srt(autodetect_decode(raw))
+
+def build_srt(df):
     out = []
-    for s in subs:
-        combined = f"{s['arabic']}\n" if s['arabic'] else ""
-        combined += "\n".join(s["english_lines"])
-        out.append(f"{s['index']}\n{s['start']} --> {s['end']}\n{combined}")
+    for s in df.itertuples(index=False):
+        combined = f"{s.arabic}\n" if s.arabic else ""
+        combined += s.english or ""
+        timing = s.timing or f"{format_timestamp(s.start)} --> {format_timestamp(s.end)}{s.settings}"
+        out.append(f"{s.index}\n{timing}\n{combined}")
     return "\n\n".join(out)
 
-def translate_batch(client, model_id, block_texts):
+def render_blocks(df):
+    """All of df as one HTML string, so the review list is a single element instead of a widget set per block."""
+    return "".join(
+        f"<div class='subtitle-block'><div class='block-heading'>Block {s.index} · "
+        f"{html.escape(s.timing) or f'{format_timestamp(s.start)} → {format_timestamp(s.end)}'}</div>"
+        f"<div class='block-text'><div>{html.escape(s.english or '')}</div>"
+        f"<div dir='rtl'>{html.escape(s.arabic or '')}</div></div></div>"
+        for s in df.itertuples(index=False)
+    )
+
+class TokenBucket:
+    """Request and token budget for one key/model pair, refilled continuously."""
+
+    def __init__(self, rpm=MODEL_RPM, tpm=MODEL_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_request_capacity = rpm
+        self.available_token_capacity = tpm
+        self.last_update = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.available_request_capacity = min(self.rpm, self.available_request_capacity + self.rpm * elapsed / 60)
+        self.available_token_capacity = min(self.tpm, self.available_token_capacity + self.tpm * elapsed / 60)
+        self.last_update = now
+
+    async def acquire(self, estimated_tokens=0):
+        estimated_tokens = min(estimated_tokens, self.tpm)
+        while True:
+            self._refill()
+            wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                if self.available_request_capacity >= 1 and self.available_token_capacity >= estimated_tokens:
+                    self.available_request_capacity -= 1
+                    self.available_token_capacity -= estimated_tokens
+                    return
+                # Sleep just long enough for the scarcer budget to refill
+                wait = max(
+                    (1 - self.available_request_capacity) * 60 / self.rpm,
+                    (estimated_tokens - self.available_token_capacity) * 60 / self.tpm,
+                )
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Back off after a 429: no requests until the server-suggested delay has passed."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.available_request_capacity = 0
+
+def retry_delay(err, default=10.0):
+    m = RETRY_DELAY_RE.search(str(err))
+    return float(m.group(1)) if m else default
+
+class TranslationCache:
+    """Size-bounded LRU map of cache_key() → Arabic, safe to share between session threads."""
+
+    def __init__(self, max_entries=TRANSLATION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def __setitem__(self, key, arabic):
+        with self._lock:
+            self._entries[key] = arabic
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@st.cache_resource
+def translation_cache():
+    """English → Arabic translations shared across reruns and sessions, keyed by cache_key()."""
+    return TranslationCache()
+
+def cache_key(english_text):
+    # Only per-line whitespace is ignored: line breaks shape the translation, so they stay part of the key
+    normalized = "\n".join(line.strip() for line in english_text.splitlines())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def english_text(idx):
+    return st.session_state.subs_df.at[idx, "english"]
+
+def estimate_tokens(text):
+    # ~4 characters per token, plus the block marker
+    return len(text) // 4 + 8
+
+def make_batches(pending_idxs):
+    """Group pending blocks so each prompt stays within BATCH_TOKEN_BUDGET and MAX_BATCH_BLOCKS."""
+    batches, batch, tokens = [], [], 0
+    for idx in pending_idxs:
+        cost = estimate_tokens(english_text(idx))
+        if batch and (tokens + cost > BATCH_TOKEN_BUDGET or len(batch) == MAX_BATCH_BLOCKS):
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(idx)
+        tokens += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+def set_arabic(idx, arabic):
+    st.session_state.subs_df.at[idx, "arabic"] = arabic
+
+@st.dialog("Edit block", width="large")
+def edit_block(row):
+    """Edit one block in a form, so only that block round-trips to the server."""
+    df = st.session_state.subs_df
+    if df.at[row, "timing"]:
+        # Unreadable times: start from the raw timing line so it can be corrected
+        start, _, end = (t.strip() for t in df.at[row, "timing"].partition("-->"))
+    else:
+        start, end = format_timestamp(df.at[row, "start"]), format_timestamp(df.at[row, "end"])
+    with st.form("edit_block"):
+        c1, c2 = st.columns(2)
+        with c1:
+            start = st.text_input("Start", start)
+            end = st.text_input("End", end)
+        with c2:
+            arabic = st.text_area("Arabic", df.at[row, "arabic"], height=80)
+            english = st.text_area("English", df.at[row, "english"], height=80)
+        if st.form_submit_button("Save"):
+            start_ms, end_ms = parse_timestamp(start), parse_timestamp(end)
+            if start_ms is None or end_ms is None:
+                st.error(f"Start and End must look like HH:MM:SS,mmm and be under {format_timestamp(MAX_TIMESTAMP_MS)}")
+                return
+            df.at[row, "start"] = start_ms
+            df.at[row, "end"] = end_ms
+            df.at[row, "timing"] = ""
+            df.at[row, "arabic"] = arabic
+            df.at[row, "english"] = english
+            st.rerun()
+
+async def translate_batch(client, model_id, block_texts, on_block=None):
+    """Translate block_texts with one streamed request.
+
+    on_block(i, arabic) fires as soon as block i is complete in the stream, i.e. once the
+    next block's marker has arrived (or the stream has ended).
+    """
     config = types.GenerateContentConfig(
-        system_instruction="Translate English subtitle blocks to natural Arabic. Maintain line breaks. Output translations preceded by [1], [2], etc.",
+        system_instruction="Translate English subtitle blocks to natural Arabic. Maintain line breaks. Output each translation preceded by the same <<<BLOCK n>>> marker as its source block.",
         temperature=0.3,
     )
     prompt = "Translate these blocks:\n\n"
     for i, txt in enumerate(block_texts, 1):
-        prompt += f"[{i}]\n{txt}\n\n"
-    response = client.models.generate_content(model=model_id, contents=prompt, config=config)
-    return [p.strip() for p in re.split(r'\[\d+\]', response.text.strip()) if p.strip()]
+        prompt += f"<<<BLOCK {i}>>>\n{txt}\n\n"
+
+    # Place each translation by its marker number, so a skipped block leaves a gap instead of shifting the rest
+    translations = [None] * len(block_texts)
+
+    def emit(num, body):
+        i = int(num) - 1
+        if 0 <= i < len(block_texts) and body.strip() and translations[i] is None:
+            translations[i] = body.strip()
+            if on_block:
+                on_block(i, translations[i])
+
+    buf = ""
+    async for chunk in await client.aio.models.generate_content_stream(model=model_id, contents=prompt, config=config):
+        buf += chunk.text or ""
+        marks = list(BLOCK_RE.finditer(buf))
+        for mark, next_mark in zip(marks, marks[1:]):
+            emit(mark.group(1), buf[mark.end() : next_mark.start()])
+        # Keep only the block still being written
+        if len(marks) > 1:
+            buf = buf[marks[-1].start() :]
+    parts = BLOCK_RE.split(buf)
+    for num, body in zip(parts[1::2], parts[2::2]):
+        emit(num, body)
+    return translations
+
+async def translate_pending(api_keys, duplicates, progress_bar, status_text, preview):
+    """Translate all pending blocks, running up to MAX_CONCURRENCY batches at once.
+
+    duplicates maps the first block of each distinct English text to every block sharing it;
+    only those first blocks are sent, and each translation is copied to its whole group.
+    Blocks land in subs_df (and in preview) as they stream in.
+    """
+    clients = [genai.Client(api_key=k) for k in api_keys]
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    cache = translation_cache()
+
+    # Track which model of each tier to use next for each API key
+    model_indices = {(i, tier): 0 for i in range(len(api_keys)) for tier in MODEL_TIERS}
+    # Rate budget for each (key, model) pair
+    buckets = {}
+
+    total = sum(len(idxs) for idxs in duplicates.values())
+    finished = set()
+    current_progress = 0
+
+    def finish_block(idx, arabic):
+        nonlocal current_progress
+        finished.add(idx)
+        for dup in duplicates[idx]:
+            set_arabic(dup, arabic)
+        cache[cache_key(english_text(idx))] = arabic
+        current_progress += len(duplicates[idx])
+        progress_bar.progress(current_progress / total)
+        preview.markdown(f"**Block {st.session_state.subs_df.at[idx, 'index']}**\n\n{arabic}")
+
+    async def run(batch_no, tier, batch):
+        # Spread batches over the keys up front instead of draining one key at a time
+        key_idx = batch_no % len(api_keys)
+        remaining = batch
+
+        def accept(idx, arabic):
+            # The fallback tier is final; otherwise output with no Arabic at all is retried there
+            if tier == "fallback" or has_arabic(arabic):
+                finish_block(idx, arabic)
+
+        async with semaphore:
+            while remaining:
+                texts = [english_text(i) for i in remaining]
+                models = MODEL_TIERS[tier]
+                current_model = models[model_indices[(key_idx, tier)]]
+                bucket = buckets.setdefault((key_idx, current_model), TokenBucket())
+                await bucket.acquire(estimated_tokens=sum(estimate_tokens(t) for t in texts))
+                try:
+                    status_text.info(f"Using Key #{key_idx+1} | Model: {current_model} | Translating Blocks {st.session_state.subs_df.at[remaining[0], 'index']} - {st.session_state.subs_df.at[remaining[-1], 'index']}")
+                    await translate_batch(
+                        clients[key_idx], current_model, texts,
+                        on_block=lambda i, arabic, sent=remaining: accept(sent[i], arabic),
+                    )
+
+                    # Success: lite batches rotate to the next model for this key to spread the rate limit;
+                    # full batches stay on the strongest model until it hits a limit or fails
+                    if tier == "lite":
+                        model_indices[(key_idx, tier)] = (model_indices[(key_idx, tier)] + 1) % len(models)
+
+                    remaining = [i for i in remaining if i not in finished]
+                    if tier == "fallback" or not remaining:
+                        return
+                    # Rejected or missing blocks get one more try on the stronger model
+                    tier = "fallback"
+                    continue
+
+                except Exception as e:
+                    # Blocks that streamed in before the failure are kept; only retry the rest
+                    remaining = [i for i in remaining if i not in finished]
+
+                    err_str = str(e).lower()
+                    if any(x in err_str for x in ["quota", "429", "resource", "limit"]):
+                        st.warning(f"Key #{key_idx+1} (Model: {current_model}) limit hit. Trying next model or rotating key...")
+                        bucket.pause(retry_delay(e))
+
+                        # Try to rotate the model for the current key first
+                        model_indices[(key_idx, tier)] = (model_indices[(key_idx, tier)] + 1) % len(models)
+
+                        # If we looped back to 0, it means all models for this key hit a limit, so we switch to the next API key
+                        if model_indices[(key_idx, tier)] == 0:
+                            key_idx = (key_idx + 1) % len(api_keys)
+                    else:
+                        st.error(f"Error with Key #{key_idx+1} (Model: {current_model}): {e}")
+
+                        # On other errors, rotate model first and jump to next key if we exhausted models
+                        model_indices[(key_idx, tier)] = (model_indices[(key_idx, tier)] + 1) % len(models)
+                        if model_indices[(key_idx, tier)] == 0:
+                            key_idx = (key_idx + 1) % len(api_keys)
+                        await asyncio.sleep(5)
+
+    # Short lines are cheap to get right, so they only use the lite tier
+    short_idxs = [i for i in duplicates if len(english_text(i)) < SHORT_TEXT_CHARS]
+    long_idxs = [i for i in duplicates if len(english_text(i)) >= SHORT_TEXT_CHARS]
+    jobs = [("lite", b) for b in make_batches(short_idxs)] + [("full", b) for b in make_batches(long_idxs)]
+    await asyncio.gather(*(run(n, tier, b) for n, (tier, b) in enumerate(jobs)))
 
 # --- Session State ---
-if "subs" not in st.session_state:
-    st.session_state.subs = []
+if "subs_df" not in st.session_state:
+    st.session_state.subs_df = pd.DataFrame(columns=SUB_COLUMNS)
 
 # --- UI: File Upload ---
 uploader = st.file_uploader("Upload SRT file", type="srt")
-if uploader and not st.session_state.subs:
-    text = autodetect_decode(uploader)
-    st.session_state.subs = parse_srt(text)
+if uploader and uploader.file_id != st.session_state.get("file_id"):
+    # A different upload: load it in place of the current file
+    st.session_state.subs_df, st.session_state.skipped_blocks = load_subs(uploader.getvalue())
+    st.session_state.file_id = uploader.file_id
+    st.session_state.page = 1
+
+if skipped := st.session_state.get("skipped_blocks"):
+    st.warning(f"{len(skipped)} block(s) with no timestamp line were skipped "
+               f"and will not be exported: {shorten(', '.join(map(str, skipped)), width=80)}")
 
-if not st.session_state.subs:
+if st.session_state.subs_df.empty:
     st.info("Please upload your SRT file.")
     st.stop()
 
@@ -96,87 +493,58 @@ if st.button("🚀 Translate Entire File (in batches)"):
         st.error("No API keys found in secrets. Please check your configuration.")
         st.stop()
         
-    pending_idxs = [i for i, s in enumerate(st.session_state.subs) if not s["arabic"].strip()]
+    df = st.session_state.subs_df
+    pending_idxs = df.index[df["arabic"].fillna("").str.strip() == ""].tolist()
+
+    # Group blocks with the same English text so each distinct text is looked up and sent once
+    groups = {}
+    for i in pending_idxs:
+        groups.setdefault(cache_key(english_text(i)), []).append(i)
+
+    # Fill blocks we have already translated and only send the rest to Gemini
+    cache = translation_cache()
+    duplicates = {}
+    for key, idxs in groups.items():
+        hit = cache.get(key)
+        if hit:
+            for i in idxs:
+                set_arabic(i, hit)
+        else:
+            duplicates[idxs[0]] = idxs
     
-    if pending_idxs:
+    if duplicates:
         progress_bar = st.progress(0)
         status_text = st.empty()
+        preview = st.empty()
         
-        key_idx = 0
-        current_progress = 0
-        
-        # Track which model to use next for each API key
-        model_indices = {i: 0 for i in range(len(api_keys))}
-        
-        while current_progress < len(pending_idxs):
-            client = genai.Client(api_key=api_keys[key_idx])
-            
-            # Select the current model for this specific key
-            current_model = MODELS[model_indices[key_idx]]
-            
-            batch = pending_idxs[current_progress : current_progress + 12]
-            texts = ["\n".join(st.session_state.subs[i]["english_lines"]) for i in batch]
-            
-            try:
-                status_text.info(f"Using Key #{key_idx+1} | Model: {current_model} | Translating Blocks {st.session_state.subs[batch[0]]['index']} - {st.session_state.subs[batch[-1]]['index']}")
-                translations = translate_batch(client, current_model, texts)
-                
-                for i, idx in enumerate(batch):
-                    if i < len(translations):
-                        # Update the main data
-                        st.session_state.subs[idx]["arabic"] = translations[i]
-                        # Update the widget's memory explicitly
-                        st.session_state[f"arabic_{idx}"] = translations[i]
-                
-                current_progress += len(batch)
-                progress_bar.progress(current_progress / len(pending_idxs))
-                
-                # Success: Rotate to the next model for this key to spread the rate limit
-                model_indices[key_idx] = (model_indices[key_idx] + 1) % len(MODELS)
-                time.sleep(10)
-                
-            except Exception as e:
-                err_str = str(e).lower()
-                if any(x in err_str for x in ["quota", "429", "resource", "limit"]):
-                    st.warning(f"Key #{key_idx+1} (Model: {current_model}) limit hit. Trying next model or rotating key...")
-                    
-                    # Try to rotate the model for the current key first
-                    model_indices[key_idx] = (model_indices[key_idx] + 1) % len(MODELS)
-                    
-                    # If we looped back to 0, it means all models for this key hit a limit, so we switch to the next API key
-                    if model_indices[key_idx] == 0:
-                        key_idx = (key_idx + 1) % len(api_keys)
-                    
-                    time.sleep(2)
-                else:
-                    st.error(f"Error with Key #{key_idx+1} (Model: {current_model}): {e}")
-                    
-                    # On other errors, rotate model first and jump to next key if we exhausted models
-                    model_indices[key_idx] = (model_indices[key_idx] + 1) % len(MODELS)
-                    if model_indices[key_idx] == 0:
-                        key_idx = (key_idx + 1) % len(api_keys)
-                    time.sleep(5)
-                    
+        asyncio.run(translate_pending(api_keys, duplicates, progress_bar, status_text, preview))
+
         st.success("Done!")
         time.sleep(1)
         st.rerun()
 
 # --- Build & Download Section ---
 if st.button("📦 Build & Download SRT"):
-    final = build_srt(st.session_state.subs)
+    final = build_srt(st.session_state.subs_df)
     st.text_area("Final Preview", final, height=200)
     st.download_button("Download .srt", final, file_name="translated.srt")
 
-# --- Display Loop ---
+# --- Review & Edit ---
 st.write("### Review Blocks")
-for i, s in enumerate(st.session_state.subs):
-    with st.container():
-        st.markdown(f"<div class='subtitle-block'><div class='block-heading'>Block {s['index']}</div>", unsafe_allow_html=True)
-        c1, c2 = st.columns(2)
-        with c1:
-            st.session_state.subs[i]["start"] = st.text_input("Start", s["start"], key=f"start_{i}")
-            st.session_state.subs[i]["end"] = st.text_input("End", s["end"], key=f"end_{i}")
-        with c2:
-            st.session_state.subs[i]["arabic"] = st.text_area("Arabic", s["arabic"], key=f"arabic_{i}", height=80)
-            st.session_state.subs[i]["english_lines"] = st.text_area("English", "\n".join(s["english_lines"]), key=f"english_{i}", height=80).splitlines()
-        st.markdown("</div>", unsafe_allow_html=True)
+df = st.session_state.subs_df
+pages = (len(df) + PAGE_SIZE - 1) // PAGE_SIZE
+c1, c2, c3 = st.columns([1, 1, 4], vertical_alignment="bottom")
+with c1:
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key="page")
+# Only the current page is rendered; rows keep their global labels, so edits land on the right block
+window = df.iloc[(page - 1) * PAGE_SIZE : page * PAGE_SIZE]
+with c2:
+    block_no = st.number_input("Block", min_value=int(window["index"].min()), max_value=int(window["index"].max()), step=1)
+with c3:
+    if st.button("✏️ Edit block"):
+        rows = window.index[window["index"] == block_no]
+        if len(rows):
+            edit_block(rows[0])
+        else:
+            st.warning(f"There is no block {block_no} on this page.")
+st.html(render_blocks(window))
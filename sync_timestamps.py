@@ -1,76 +1,160 @@
 #!/usr/bin/env python3
+import os
 import re
 import sys
+import mmap
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
 from pathlib import Path
 from textwrap import shorten
 
-# Regex to match SRT timestamp lines
+# Regex to match SRT timestamp lines (same leniency as srte.py), keeping any cue settings after the end time
 TIMESTAMP_RE = re.compile(
-    r'^(?P<start>\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(?P<end>\d{2}:\d{2}:\d{2},\d{3})$'
+    r'^(?P<start>\d+:\d{2}:\d{2}[,.]\d{3})\s*-->\s*(?P<end>\d+:\d{2}:\d{2}[,.]\d{3})(?P<settings>.*)$'
 )
 # Regex to detect any Arabic character
 ARABIC_RE = re.compile(r'[\u0600-\u06FF]')
+UTF8_BOM = b'\xef\xbb\xbf'
+# Below this many file pairs, worker start-up costs more than it saves
+PARALLEL_MIN_PAIRS = 4
+# SRT parser states
+EXPECT_INDEX, EXPECT_TS, EXPECT_TEXT, SKIP_BLOCK = range(4)
 
 def make_key(name: str) -> str:
     """Match files by their first 15 characters."""
     return name[:15]
 
+def has_arabic(line: str) -> bool:
+    """True if the line holds any Arabic character; ASCII lines skip the regex."""
+    return not line.isascii() and ARABIC_RE.search(line) is not None
+
 def normalize_text(lines: list[str]) -> str:
     """
     Strip each line, collapse internal whitespace, join with a single space.
     Only called on lines that have already been filtered to exclude Arabic.
     """
-    return " ".join(" ".join(l.split()) for l in lines).strip()
-
-def parse_srt(path: Path) -> list[dict]:
+    # One join, then str.split() collapses every whitespace run (and trims the ends) in C
+    return " ".join(" ".join(lines).split())
+
+def make_entry(idx: int, timing: str, m: re.Match | None, text_lines: list[str]) -> dict:
+    # Filter out Arabic lines for matching
+    english_lines = [l for l in text_lines if not has_arabic(l)]
+    return {
+        "index": idx,
+        # start/end are None when the timing line did not parse; it is then written back verbatim
+        "start": m and m['start'],
+        "end": m and m['end'],
+        "settings": m['settings'] if m else "",
+        "timing": timing,
+        "text_lines": text_lines,
+        "norm_text": normalize_text(english_lines)
+    }
+
+def iter_srt(path: Path):
     """
-    Parse an SRT‐style file into a list of entries:
-    [{'index': int, 'timestamp': str, 'text_lines': [str,...], 'norm_text': str}, ...]
-    Uses utf-8-sig to strip BOM if present.
+    Stream entries from an SRT‐style file one block at a time:
+    {'index': int, 'start': str | None, 'end': str | None, 'settings': str,
+     'timing': str, 'text_lines': [str,...], 'norm_text': str}
+    The file is memory-mapped and read as UTF-8 bytes; a leading BOM is skipped
+    and only timestamp/text lines are decoded. Blocks with a malformed timing
+    line are still yielded, with start/end None, so they survive a rewrite.
     """
-    raw = path.read_text(encoding='utf-8-sig').splitlines()
-    entries = []
-    buf = []
-    for line in raw + [""]:
-        if line.strip() == "" and buf:
-            # buf[0] = index, buf[1] = timestamp, buf[2:] = text lines
-            idx_line = buf[0].lstrip('\ufeff')
-            try:
-                idx = int(idx_line)
-            except ValueError:
-                sys.stderr.write(f"Warning: invalid index '{buf[0]}' in {path.name}, skipping block\n")
-                buf = []
-                continue
-
-            ts = buf[1]
-            text_lines = buf[2:]
-
-            # Filter out Arabic lines for matching
-            english_lines = [l for l in text_lines if not ARABIC_RE.search(l)]
-            norm = normalize_text(english_lines)
-
-            entries.append({
-                "index": idx,
-                "timestamp": ts,
-                "text_lines": text_lines,
-                "norm_text": norm
-            })
-            buf = []
-        else:
-            buf.append(line)
-    return entries
+    with path.open('rb') as f:
+        # mmap cannot map an empty file
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:3] == UTF8_BOM:
+                mm.seek(3)
+            idx, timing, m, text_lines = 0, "", None, []
+            state = EXPECT_INDEX
+            # readline() only splits on \n; splitlines() on each chunk also handles
+            # CR-only files (one big chunk) and strips \r\n / \r / \n endings
+            lines = (l for chunk in iter(mm.readline, b"") for l in chunk.splitlines())
+            # Trailing sentinel flushes the last block
+            for line in chain(lines, [b""]):
+                if not line.strip():
+                    if state == EXPECT_TEXT:
+                        yield make_entry(idx, timing, m, text_lines)
+                    elif state == EXPECT_TS:
+                        sys.stderr.write(f"Warning: block {idx} has no timestamp in {path.name}, skipping block\n")
+                    state = EXPECT_INDEX
+                elif state == EXPECT_INDEX:
+                    try:
+                        # int() parses ASCII digits straight from bytes
+                        idx = int(line.removeprefix(UTF8_BOM))
+                    except ValueError:
+                        sys.stderr.write(f"Warning: invalid index '{line.decode('utf-8', 'replace')}' in {path.name}, skipping block\n")
+                        state = SKIP_BLOCK
+                        continue
+                    state = EXPECT_TS
+                elif state == EXPECT_TS:
+                    timing = line.decode('utf-8').strip()
+                    m = TIMESTAMP_RE.match(timing)
+                    if not m:
+                        sys.stderr.write(f"Warning: malformed timestamp in block {idx} of {path.name}, keeping block unchanged\n")
+                    text_lines = []
+                    state = EXPECT_TEXT
+                elif state == EXPECT_TEXT:
+                    text_lines.append(line.decode('utf-8'))
+
+def parse_srt(path: Path) -> list[dict]:
+    """Parse an SRT‐style file into a list of entries (see iter_srt)."""
+    return list(iter_srt(path))
 
 def write_srt(entries: list[dict], out_path: Path):
     """Write entries back to SRT format."""
     with out_path.open('w', encoding='utf-8') as f:
         for e in entries:
             f.write(f"{e['index']}\n")
-            f.write(f"{e['timestamp']}\n")
+            if e['start'] is None:
+                f.write(f"{e['timing']}\n")
+            else:
+                f.write(f"{e['start']} --> {e['end']}{e['settings']}\n")
             for l in e['text_lines']:
                 f.write(f"{l}\n")
             f.write("\n")
 
+def process_pair(nf: Path, of: Path, out_dir: Path | None):
+    """Copy timestamps from new file nf into old file of, writing to out_dir (or over of)."""
+    old_entries = parse_srt(of)
+    if not old_entries and of.stat().st_size > 0:
+        # Writing would replace a file we could not read with an empty one
+        sys.stderr.write(f"Skipping {of.name}: no SRT blocks could be parsed, leaving it untouched\n")
+        return
+
+    # build text→deque[(start, end)]; the new file is only streamed through
+    ts_map: dict[str, deque[tuple[str, str]]] = {}
+    for e in iter_srt(nf):
+        # Only timed entries with non-empty English text will be in ts_map
+        if e['norm_text'] and e['start'] is not None:
+            ts_map.setdefault(e['norm_text'], deque()).append((e['start'], e['end']))
+
+    # walk old entries, replacing where we can
+    for e in old_entries:
+        if e['start'] is None:
+            # Malformed timing line: already warned about, written back as-is
+            continue
+        txt = e['norm_text']
+        if not txt or txt not in ts_map or not ts_map[txt]:
+            print(f"{of.name}: entry {e['index']} has no match for English text "
+                  f"\"{shorten(txt, width=30)}\"")
+            continue
+        lst = ts_map[txt]
+        if len(lst) > 1:
+            sys.stderr.write(
+                f"Warning: {of.name} entry {e['index']} text is duplicated in new file; "
+                "using next timestamp\n"
+            )
+        e['start'], e['end'] = lst.popleft()
+
+    # write out
+    out_path = (out_dir / of.name) if out_dir else of
+    write_srt(old_entries, out_path)
+    print(f"{of.name}: written updated timestamps to {out_path}")
+
 def main():
     p = argparse.ArgumentParser(
         description="Copy timestamps from new→old by matching only English text lines."
@@ -87,54 +171,34 @@ def main():
     if args.out_dir:
         args.out_dir.mkdir(parents=True, exist_ok=True)
 
+    # key every file once up front
+    new_files = [(make_key(nf.name), nf) for nf in args.new_dir.iterdir() if nf.is_file()]
+    old_files = [(make_key(of.name), of) for of in args.old_dir.iterdir() if of.is_file()]
+
     # map new files by 15‑char key
     new_map: dict[str, Path] = {}
-    for nf in args.new_dir.iterdir():
-        if nf.is_file():
-            k = make_key(nf.name)
-            if k in new_map:
-                sys.stderr.write(f"Warning: duplicate key {k!r}, using {nf.name}\n")
-            new_map[k] = nf
-
-    # process old files
-    for of in args.old_dir.iterdir():
-        if not of.is_file():
-            continue
-        key = make_key(of.name)
+    for k, nf in new_files:
+        if k in new_map:
+            sys.stderr.write(f"Warning: duplicate key {k!r}, using {nf.name}\n")
+        new_map[k] = nf
+
+    # pair up old files with their new counterparts
+    pairs = []
+    for key, of in old_files:
         nf  = new_map.get(key)
         if not nf:
             sys.stderr.write(f"Skipping {of.name}: no new file for key '{key}'\n")
             continue
-
-        new_entries = parse_srt(nf)
-        old_entries = parse_srt(of)
-
-        # build text→list[timestamp]
-        ts_map: dict[str, list[str]] = {}
-        for e in new_entries:
-            # Only entries with non-empty English text will be in ts_map
-            if e['norm_text']:
-                ts_map.setdefault(e['norm_text'], []).append(e['timestamp'])
-
-        # walk old entries, replacing where we can
-        for e in old_entries:
-            txt = e['norm_text']
-            if not txt or txt not in ts_map or not ts_map[txt]:
-                print(f"{of.name}: entry {e['index']} has no match for English text "
-                      f"\"{shorten(txt, width=30)}\"")
-                continue
-            lst = ts_map[txt]
-            if len(lst) > 1:
-                sys.stderr.write(
-                    f"Warning: {of.name} entry {e['index']} text is duplicated in new file; "
-                    "using next timestamp\n"
-                )
-            e['timestamp'] = lst.pop(0)
-
-        # write out
-        out_path = (args.out_dir / of.name) if args.out_dir else of
-        write_srt(old_entries, out_path)
-        print(f"{of.name}: written updated timestamps to {out_path}")
+        pairs.append((nf, of))
+
+    # pairs are independent; only pay for worker processes when there are enough of them
+    if len(pairs) < PARALLEL_MIN_PAIRS:
+        for nf, of in pairs:
+            process_pair(nf, of, args.out_dir)
+    else:
+        with ProcessPoolExecutor() as ex:
+            # list() drains the iterator so worker exceptions surface here
+            list(ex.map(process_pair, *zip(*pairs), repeat(args.out_dir)))
 
 if __name__ == '__main__':
     main()